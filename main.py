@@ -1,13 +1,19 @@
 import asyncio
 import logging
 import os
-import json
 import time
+import uuid
+import datetime
 import sys
+import threading
+from collections import OrderedDict, deque
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple, Callable, Awaitable
 
-import requests
+import aiohttp
+import orjson
+from cachetools import TTLCache
 from PIL import Image, ImageDraw, ImageFont
 
 # 正确的导入 - 使用AstrBot提供的类型
@@ -19,159 +25,162 @@ from astrbot.api.message_components import Plain, Image as ImageComp # 明确导
 # --- 常量和设置 ---
 log = logging.getLogger(__name__)
 PLUGIN_DIR = Path(__file__).parent.resolve() # 获取插件文件所在的目录
+TEMPLATE_PATH = PLUGIN_DIR / "hymb.png"
+FONT_PATH = PLUGIN_DIR / "FZSTK.TTF"
+TEMP_IMAGE_DIR = PLUGIN_DIR / "temp_images"
+TEMP_IMAGE_DIR.mkdir(exist_ok=True) # 如果临时目录不存在则创建它
+API_MAX_RETRIES = 2 # 网关错误时的最大重试次数
+API_RETRY_BACKOFF = 0.3 # 重试退避基数（秒），按 0.3s、0.6s 递增
+API_RETRY_STATUSES = frozenset({502, 503, 504})
+API_CACHE_MAXSIZE = 512
+API_CACHE_TTL = 180 # 有结果的查询缓存时间（秒），订单状态变化较慢
+API_NEGATIVE_CACHE_TTL = 10 # 无结果的查询只做短时间缓存
+GLYPH_CACHE_MAXSIZE = 2048 # 字形遮罩缓存上限
+FONT_SIZE = 80 # 通知图片上所有文本的字号（按模板原始尺寸）
+# 输出图片相对模板原始尺寸 (2160x3360) 的缩放比例；聊天客户端显示时本就会缩小，
+# 减半后像素数只有四分之一，绘制与编码都更快。设为 1.0 可输出原始分辨率
+RENDER_SCALE = 0.5
+IMAGE_MAX_CONCURRENCY = 2 # 同时生成图片的最大数量
+RECENT_IMAGES_MAXLEN = 10 # temp_images 中最多保留的图片数量
+RESULT_CACHE_MAXSIZE = 64 # 已生成图片结果缓存的最大条目数
+RESULT_CACHE_TTL = 120 # 已生成图片可直接复用的时间（秒）
+
+def _scale(position: Tuple[int, int]) -> Tuple[int, int]:
+    """将模板原始尺寸下的坐标换算为输出图片坐标。"""
+    return round(position[0] * RENDER_SCALE), round(position[1] * RENDER_SCALE)
+
+# 订单字段在模板上的绘制位置，导入时即换算为输出图片坐标
+RENDER_FONT_SIZE = round(FONT_SIZE * RENDER_SCALE)
+CONTENT_SLOTS: Tuple[Tuple[str, Tuple[int, int]], ...] = tuple(
+    (key, _scale(position)) for key, position in (
+        ('v0', (1490, 1030)),
+        ('v1', (1450, 1300)),
+        ('v2', (1100, 1570)),
+        ('v3', (1440, 1850)),
+        ('v4', (1000, 2110)),
+        ('v5', (1440, 2380)),
+    )
+)
+TIMESTAMP_SLOT = _scale((1210, 2680))
+
+# 字形遮罩缓存：(字体 id, 字号, 字符) -> 'L' 模式遮罩；None 表示空白字符
+# 图片生成可能在线程池中并发进行，因此用锁保护
+_GLYPH_CACHE: "OrderedDict[tuple, Optional[Image.Image]]" = OrderedDict()
+_GLYPH_LOCK = threading.Lock()
 
 # --- 辅助函数 ---
 
-def resource_path(relative_path: str) -> Path:
-    """获取插件目录内资源的绝对路径。"""
-    return PLUGIN_DIR / relative_path
-
-async def fetch_wechat_info(content: str) -> Optional[Dict[str, Any]]:
-    """向微信小程序API发送请求。"""
-    url = "https://i.qz.fkw.com/appAjax/wxAppConnectionQuery.jsp?cmd=search"
-    payload = {
-        "wxappAid": "3086825",
-        "wxappId": "101",
-        "itemId": "103",
-        "contentList": json.dumps([{"key": "v2", "value": content}])
-    }
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    response = None
+def _order_key(order_id: str) -> str:
+    """规范化订单号，作为各级缓存共用的键。"""
+    return order_id.strip().lower()
+
+@lru_cache(maxsize=32)
+def _get_font(path: Optional[str], size: int):
+    """按 (字体路径, 字号) 缓存字体对象，避免每次绘制都重新解析 TTF 文件。"""
+    if path:
+        return ImageFont.truetype(path, size)
+    return ImageFont.load_default()
+
+@lru_cache(maxsize=1)
+def _get_template(path: str) -> Image.Image:
+    """加载并缓存已转换为 RGB 并按 RENDER_SCALE 缩放的模板图片，调用方需 copy() 后再绘制。"""
+    with Image.open(path) as template:
+        template = template.convert('RGB')
+    if RENDER_SCALE != 1:
+        size = (round(template.width * RENDER_SCALE), round(template.height * RENDER_SCALE))
+        template = template.resize(size, Image.LANCZOS)
+    return template
+
+def _get_glyph(font, ch: str) -> Optional[Image.Image]:
+    """获取单个字符的渲染遮罩，命中缓存时跳过 FreeType 排版与光栅化。"""
+    # 字体对象由 _get_font 长期持有，id 在进程内稳定
+    key = (id(font), getattr(font, 'size', 0), ch)
+    with _GLYPH_LOCK:
+        if key in _GLYPH_CACHE:
+            _GLYPH_CACHE.move_to_end(key)
+            return _GLYPH_CACHE[key]
+
+    _, _, right, bottom = font.getbbox(ch)
+    tile = None
+    if right > 0 and bottom > 0:
+        tile = Image.new('L', (right, bottom), 0)
+        ImageDraw.Draw(tile).text((0, 0), ch, font=font, fill=255)
+
+    with _GLYPH_LOCK:
+        _GLYPH_CACHE[key] = tile
+        if len(_GLYPH_CACHE) > GLYPH_CACHE_MAXSIZE:
+            _GLYPH_CACHE.popitem(last=False)
+    return tile
+
+def _draw_text_cached(img: Image.Image, position, text: str, font, fill=(0, 0, 0)) -> None:
+    """逐字符贴上缓存的字形遮罩，效果等同于 ImageDraw.text 的单行绘制。"""
+    x, y = position
+    for ch in text:
+        tile = _get_glyph(font, ch)
+        if tile is not None:
+            img.paste(fill, (round(x), y), mask=tile)
+        x += font.getlength(ch)
+
+def _safe_unlink(path: Path) -> None:
+    """删除文件，失败时只记录错误（例如文件被占用），不中断流程。"""
     try:
-        log.info(f"Attempting to fetch API data for order: {content}")
-        loop = asyncio.get_event_loop()
-        future = loop.run_in_executor(
-            None, # 使用默认执行器
-            lambda: requests.post(url, data=payload, headers=headers, timeout=15) # 添加了超时
-        )
-        response = await future
-        log.info(f"Finished API request for order {content}. Status: {response.status_code if response else 'N/A'}")
-
-        if response and response.status_code == 200:
-             response_json = response.json()
-             log.debug(f"API Response JSON for {content}: {response_json}") # 打印成功时的API响应JSON
-             response.raise_for_status() # 对不良响应 (4xx 或 5xx) 抛出 HTTPError
-             return response_json
-        elif response:
-             log.error(f"API returned non-200 status code {response.status_code} for order {content}. Response text: {response.text}") # 记录非200响应
-             return None
-        else:
-             log.error(f"API request failed to get a response for order {content}.") # 记录无响应
-             return None
-
-    except requests.exceptions.Timeout:
-        log.error(f"API Request Timeout for order {content}")
-        return None
-    except requests.exceptions.RequestException as e:
-        log.error(f"API Request Error for order {content}: {e}")
-        return None
-    except json.JSONDecodeError as e:
-        # 在JSON解析错误时，确保response对象存在并打印其内容，帮助调试
-        response_text = response.text if response is not None else "N/A (No response received)"
-        log.error(f"Failed to decode API response JSON for order {content}: {e}. Response text: {response_text}")
-        return None
-    except Exception as e:
-         log.error(f"An unexpected error occurred during API request for order {content}: {e}", exc_info=True)
-         return None
-
-
-def generate_image(data: Dict[str, str]) -> Optional[Path]:
-    """生成通知图片。"""
+        path.unlink(missing_ok=True)
+        log.info("Successfully deleted temp image: %s", path)
+    except OSError:
+        log.exception("Failed to delete temp image %s", path)
+
+def generate_image(data: Dict[str, str], template_path: Optional[Path], font_path: Optional[Path],
+                   temp_image_dir: Path) -> Optional[Path]:
+    """生成通知图片。路径参数由插件初始化时预先校验，None 表示文件不存在。"""
     log.info("Starting image generation...")
     img_path = None # 初始化 img_path 变量
     try:
-        template_path = resource_path("hymb.png")
-        font_path = resource_path("FZSTK.TTF")
-        temp_image_dir = PLUGIN_DIR / "temp_images"
-        temp_image_dir.mkdir(exist_ok=True) # 如果临时目录不存在则创建它
-
-        if not template_path.exists():
-            log.error(f"Image template not found at: {template_path}")
+        if template_path is None:
+            log.error("Image template is unavailable, skipping image generation.")
             return None
 
-        if font_path and not font_path.exists():
-            log.warning(f"Font file not found at: {font_path}. Falling back to default font.")
-            font_path = None
-
-        img = Image.open(template_path).convert('RGB')
-        draw = ImageDraw.Draw(img)
+        img = _get_template(str(template_path)).copy()
 
         batch_number = data.get('v0', 'N/A')
-        order_id_api = data.get('v2', 'N/A')
-
-        content_map = [
-            (data.get('v0', 'N/A'), (1490, 1030), 80),
-            (data.get('v1', 'N/A'), (1450, 1300), 80),
-            (order_id_api,         (1100, 1570), 80),
-            (data.get('v3', 'N/A'), (1440, 1850), 80),
-            (data.get('v4', 'N/A'), (1000, 2110), 80),
-            (data.get('v5', 'N/A'), (1440, 2380), 80),
-        ]
-
-        # 绘制文本
-        for text, position, font_size in content_map:
-            try:
-                if font_path:
-                    font = ImageFont.truetype(str(font_path), font_size)
-                else:
-                     font = ImageFont.load_default()
-            except Exception as e:
-                log.warning(f"Could not load specified font for text '{text}': {e}. Using default.")
-                try:
-                     font = ImageFont.load_default()
-                except Exception as fallback_e:
-                     log.error(f"Failed to load default font for text: {fallback_e}. Cannot draw text.")
-                     continue # Skip drawing this text
 
-            try:
-                 draw.text(position, str(text), font=font, fill=(0, 0, 0))
-            except Exception as draw_e:
-                 log.error(f"Failed to draw text '{text}' at position {position}: {draw_e}")
-
-
-        # 添加生成时间戳
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-        timestamp_position = (1210, 2680)
-        timestamp_font_size = 80
+        # 所有文本使用同一字号，字体只加载一次
         try:
-            if font_path:
-                timestamp_font = ImageFont.truetype(str(font_path), timestamp_font_size)
-            else:
-                timestamp_font = ImageFont.load_default()
+            font = _get_font(str(font_path) if font_path else None, RENDER_FONT_SIZE)
         except Exception as e:
-             log.warning(f"Could not load specified font for timestamp: {e}. Using default.")
-             try:
-                 timestamp_font = ImageFont.load_default()
-             except Exception as fallback_e:
-                 log.error(f"Failed to load default font for timestamp: {fallback_e}. Cannot draw timestamp.")
-                 timestamp_font = None
-
-        if timestamp_font:
-            try:
-                draw.text(timestamp_position, timestamp, font=timestamp_font, fill=(0, 0, 0))
-            except Exception as draw_e:
-                 log.error(f"Failed to draw timestamp at position {timestamp_position}: {draw_e}")
+            log.warning("Could not load specified font: %s. Using default.", e)
+            font = _get_font(None, RENDER_FONT_SIZE)
 
+        # 生成时间戳，显示时间与文件名共用同一时刻
+        now = datetime.datetime.now()
+        timestamp = now.strftime('%Y-%m-%d %H:%M:%S')
+
+        # 绘制文本
+        try:
+            for key, position in CONTENT_SLOTS:
+                _draw_text_cached(img, position, str(data.get(key, 'N/A')), font)
+            _draw_text_cached(img, TIMESTAMP_SLOT, timestamp, font)
+        except Exception as draw_e:
+            log.error("Failed to draw text onto image: %s", draw_e, exc_info=True)
 
         # 临时保存图片
         safe_batch = batch_number.lstrip('#').replace('/', '_').replace('\\', '_').replace(' ', '_')
         if not safe_batch or safe_batch.isspace():
              safe_batch = "UnknownBatch"
-        current_timestamp = time.strftime('%Y%m%d%H%M%S_%f') # 添加微秒，提高唯一性
+        # time.strftime 不支持 %f，改用随机后缀保证并发生成时文件名唯一
+        current_timestamp = f"{now.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
         img_filename = f"Heyao_{safe_batch}_{current_timestamp}.png"
         img_path = temp_image_dir / img_filename
 
-        img.save(img_path, format='PNG', quality=95)
-        log.info(f"Generated image saved successfully to: {img_path}")
+        # 图片发送后即被清理，文件大小无关紧要，使用最快的 zlib 压缩级别
+        img.save(img_path, format='PNG', compress_level=1)
+        log.info("Generated image saved successfully to: %s", img_path)
         return img_path
 
     except FileNotFoundError as e:
-        log.error(f"Error finding required file for image generation: {e}")
+        log.error("Error finding required file for image generation: %s", e)
         return None
     except Exception as e:
-        log.error(f"Error generating image: {e}", exc_info=True)
+        log.error("Error generating image: %s", e, exc_info=True)
         return None
     # 暂时保留不清理，用于测试
     # finally:
@@ -188,9 +197,177 @@ class HeyaoQueryStar(Star):
     def __init__(self, context: Context):
         super().__init__(context)
         log.info("HeyaoQueryStar plugin initialized.")
-        # >>>>>> 添加：用于存储上一张图片的路径 <<<<<<
-        self.last_image_path: Optional[Path] = None
-        log.info("Initialized last_image_path attribute.")
+        # 插件级 HTTP 会话，复用 TCP/TLS 连接，避免每次查询重新握手
+        self._http = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=15),
+            connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300)
+        )
+        # 资源文件只在初始化时检查一次，避免每次生成图片都访问文件系统
+        self._template_path: Optional[Path] = TEMPLATE_PATH
+        if not self._template_path.exists():
+            log.error("Image template not found at: %s", self._template_path)
+            self._template_path = None
+        self._font_path: Optional[Path] = FONT_PATH
+        if not self._font_path.exists():
+            log.warning("Font file not found at: %s. Falling back to default font.", self._font_path)
+            self._font_path = None
+        # 清理上次运行遗留的临时图片
+        for stale_image in TEMP_IMAGE_DIR.glob("*.png"):
+            _safe_unlink(stale_image)
+        # 最近生成的图片，超出上限时删除最旧的一张
+        self._recent_images: deque = deque(maxlen=RECENT_IMAGES_MAXLEN)
+        self._background_tasks: set = set()
+        # 限制同时生成的图片数量，避免突发请求占用过多内存
+        self._render_semaphore = asyncio.Semaphore(IMAGE_MAX_CONCURRENCY)
+        # API 响应缓存：键为规范化后的订单号
+        self._api_cache = TTLCache(maxsize=API_CACHE_MAXSIZE, ttl=API_CACHE_TTL)
+        self._api_negative_cache = TTLCache(maxsize=API_CACHE_MAXSIZE, ttl=API_NEGATIVE_CACHE_TTL)
+        # 结果缓存：订单号 -> (图片路径, 生成时间)，命中时跳过查询与绘制
+        self._result_cache: "OrderedDict[str, Tuple[Path, float]]" = OrderedDict()
+        # 进行中的上游请求与图片绘制，用于合并相同订单的并发查询
+        self._fetch_inflight: Dict[str, asyncio.Future] = {}
+        self._render_inflight: Dict[str, asyncio.Future] = {}
+
+    async def terminate(self):
+        """插件卸载时关闭 HTTP 会话。"""
+        if not self._http.closed:
+            await self._http.close()
+        log.info("HeyaoQueryStar HTTP session closed.")
+
+    def _get_cached_result(self, order_id: str) -> Optional[Path]:
+        """返回仍在有效期内且文件仍存在的已生成图片。"""
+        key = _order_key(order_id)
+        entry = self._result_cache.get(key)
+        if entry is None:
+            return None
+        image_path, created_at = entry
+        if time.time() - created_at >= RESULT_CACHE_TTL or not image_path.exists():
+            del self._result_cache[key]
+            return None
+        self._result_cache.move_to_end(key)
+        return image_path
+
+    def _cache_result(self, order_id: str, image_path: Path) -> None:
+        """记录新生成的图片，超出上限时淘汰最久未使用的条目。"""
+        key = _order_key(order_id)
+        self._result_cache[key] = (image_path, time.time())
+        self._result_cache.move_to_end(key)
+        if len(self._result_cache) > RESULT_CACHE_MAXSIZE:
+            self._result_cache.popitem(last=False)
+
+    async def _single_flight(self, inflight: Dict[str, asyncio.Future], key: str,
+                             factory: Callable[[], Awaitable[Any]]) -> Any:
+        """合并相同 key 的并发调用：首个调用者执行 factory，其余调用者等待同一结果。"""
+        pending = inflight.get(key)
+        if pending is not None:
+            log.info("Joining in-flight request for key: %s", key)
+            # shield 防止某个等待者被取消时连带取消共享的 Future
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        inflight[key] = future
+        try:
+            result = await factory()
+            future.set_result(result)
+            return result
+        finally:
+            # 首个调用者出错或被取消时，等待者按失败 (None) 处理
+            if not future.done():
+                future.set_result(None)
+            inflight.pop(key, None)
+
+    async def _render_image(self, order_id: str, order_details: Dict[str, str]) -> Optional[Path]:
+        """生成订单图片并登记到临时图片队列与结果缓存。"""
+        # 图片绘制与编码是 CPU 密集操作，放到线程中执行以免阻塞事件循环
+        async with self._render_semaphore:
+            image_path = await asyncio.to_thread(
+                generate_image, order_details, self._template_path, self._font_path, TEMP_IMAGE_DIR
+            )
+        if image_path and image_path.exists():
+            self._track_image(image_path)
+            self._cache_result(order_id, image_path)
+        return image_path
+
+    def _track_image(self, image_path: Path) -> None:
+        """记录新生成的图片；队列已满时在后台删除最旧的一张，不阻塞当前响应。"""
+        evicted = None
+        if len(self._recent_images) == self._recent_images.maxlen:
+            evicted = self._recent_images[0]
+        self._recent_images.append(image_path)
+        if evicted:
+            log.info("Scheduling deletion of old image: %s", evicted)
+            task = asyncio.create_task(asyncio.to_thread(_safe_unlink, evicted))
+            # 保留任务引用，防止其在完成前被垃圾回收
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def fetch_wechat_info(self, content: str, no_cache: bool = False) -> Optional[Dict[str, Any]]:
+        """查询订单信息，优先使用缓存。no_cache=True 时跳过缓存（调试用）。"""
+        if no_cache:
+            return await self._request_wechat_info(content)
+
+        key = _order_key(content)
+        for cache in (self._api_cache, self._api_negative_cache):
+            cached = cache.get(key)
+            if cached is not None:
+                log.info("API cache hit for order: %s", content)
+                return cached
+
+        # 同一订单的并发查询共用一次上游请求
+        result = await self._single_flight(
+            self._fetch_inflight, key, lambda: self._request_wechat_info(content)
+        )
+        if isinstance(result, dict):
+            # 请求失败或响应格式异常不缓存；查无结果只短时间缓存
+            if result.get('queryDataList'):
+                self._api_cache[key] = result
+            else:
+                self._api_negative_cache[key] = result
+        return result
+
+    async def _request_wechat_info(self, content: str) -> Optional[Dict[str, Any]]:
+        """向微信小程序API发送请求。"""
+        url = "https://i.qz.fkw.com/appAjax/wxAppConnectionQuery.jsp?cmd=search"
+        payload = {
+            "wxappAid": "3086825",
+            "wxappId": "101",
+            "itemId": "103",
+            "contentList": orjson.dumps([{"key": "v2", "value": content}]).decode()
+        }
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        response_body = b"N/A (No response received)"
+        try:
+            log.info("Attempting to fetch API data for order: %s", content)
+            for attempt in range(API_MAX_RETRIES + 1):
+                async with self._http.post(url, data=payload, headers=headers) as response:
+                    log.info("Finished API request for order %s. Status: %s", content, response.status)
+                    if response.status not in API_RETRY_STATUSES or attempt == API_MAX_RETRIES:
+                        response.raise_for_status() # 对不良响应 (4xx 或 5xx) 抛出 ClientResponseError
+                        response_body = await response.read()
+                        response_json = orjson.loads(response_body)
+                        log.debug("API Response JSON for %s: %s", content, response_json) # 打印成功时的API响应JSON
+                        return response_json
+
+                # 网关类错误通常是暂时的，退避后重试
+                delay = API_RETRY_BACKOFF * (2 ** attempt)
+                log.warning("API returned %s for order %s, retrying in %.1fs (%s/%s)", response.status, content, delay, attempt + 1, API_MAX_RETRIES)
+                await asyncio.sleep(delay)
+
+        except asyncio.TimeoutError:
+            log.error("API Request Timeout for order %s", content)
+            return None
+        except aiohttp.ClientError as e:
+            log.error("API Request Error for order %s: %s", content, e)
+            return None
+        except orjson.JSONDecodeError as e:
+            # 在JSON解析错误时打印响应内容，帮助调试
+            log.error("Failed to decode API response JSON for order %s: %s. Response text: %s", content, e, response_body.decode(errors='replace'))
+            return None
+        except Exception as e:
+            log.error("An unexpected error occurred during API request for order %s: %s", content, e, exc_info=True)
+            return None
 
 
     @filter.command("heyao", alias={"河妖", "查订单"})
@@ -198,7 +375,7 @@ class HeyaoQueryStar(Star):
 
         log.info("handle_heyao_query started.")
         full_message = event.get_message_str()
-        log.debug(f"Received full message: {full_message}")
+        log.debug("Received full message: %s", full_message)
         parts = full_message.split(maxsplit=1)
 
         if len(parts) < 2 or not parts[1].strip():
@@ -215,24 +392,32 @@ class HeyaoQueryStar(Star):
             log.info("handle_heyao_query finished (empty order ID).")
             return
 
-        log.info(f"Received query for order: {order_id_user}")
+        log.info("Received query for order: %s", order_id_user)
+
+        cached_image = self._get_cached_result(order_id_user)
+        if cached_image:
+            log.info("Result cache hit for order %s: %s", order_id_user, cached_image)
+            yield event.chain_result([ImageComp(file=str(cached_image.absolute()))])
+            log.info("handle_heyao_query finished (result cache hit).")
+            return
+
         yield event.plain_result(f"正在查询订单号：{order_id_user}...")
-        log.info(f"Sent initial query message for order {order_id_user}.")
+        log.info("Sent initial query message for order %s.", order_id_user)
 
-        api_data = await fetch_wechat_info(order_id_user)
+        api_data = await self.fetch_wechat_info(order_id_user)
 
         if api_data is None:
-            log.error(f"API data fetch failed or returned invalid data for order: {order_id_user}")
+            log.error("API data fetch failed or returned invalid data for order: %s", order_id_user)
             yield event.plain_result(f"查询订单 {order_id_user} 时出错，请检查日志或稍后再试。")
             log.info("handle_heyao_query finished (API fetch failed).")
             return
 
         try:
-            log.debug(f"Raw API data received: {api_data}")
+            log.debug("Raw API data received: %s", api_data)
             query_data_list = api_data.get('queryDataList')
 
             if not query_data_list or not isinstance(query_data_list, list) or len(query_data_list) == 0:
-                log.warning(f"API response for {order_id_user} has no 'queryDataList' or it is empty/invalid type. Data: {api_data}")
+                log.warning("API response for %s has no 'queryDataList' or it is empty/invalid type. Data: %s", order_id_user, api_data)
                 error_msg = api_data.get('msg', '未找到订单信息或API返回格式不正确。')
                 if error_msg == '未找到订单信息或API返回格式不正确。':
                      if api_data.get('code') == -1:
@@ -246,46 +431,29 @@ class HeyaoQueryStar(Star):
 
             order_details = query_data_list[0].get('content')
             if not order_details or not isinstance(order_details, dict):
-                 log.warning(f"First item in 'queryDataList' for {order_id_user} is missing 'content' or 'content' is not a dictionary. Data: {query_data_list[0]}")
+                 log.warning("First item in 'queryDataList' for %s is missing 'content' or 'content' is not a dictionary. Data: %s", order_id_user, query_data_list[0])
                  yield event.plain_result(f"查询成功，但未能解析订单详细信息。(订单号: {order_id_user})")
                  log.info("handle_heyao_query finished (API content invalid).")
                  return
 
-            log.info(f"Successfully parsed data for order {order_id_user}: {order_details}")
+            log.info("Successfully parsed data for order %s: %s", order_id_user, order_details)
 
         except Exception as e: # 简化捕获，包含KeyError, IndexError, TypeError等
-            log.error(f"Error processing API response for order {order_id_user}: {e}", exc_info=True)
-            log.debug(f"API Response Data: {api_data}")
+            log.error("Error processing API response for order %s: %s", order_id_user, e, exc_info=True)
+            log.debug("API Response Data: %s", api_data)
             yield event.plain_result(f"处理API响应时发生错误。(订单号: {order_id_user})")
             log.info("handle_heyao_query finished (API processing error).")
             return
 
-        # >>>>>> 添加：删除上一张图片的逻辑 <<<<<<
-        # 在生成新图片之前，先检查并删除上一次生成的图片
-        if self.last_image_path and self.last_image_path.exists():
-            log.info(f"Attempting to delete previous image: {self.last_image_path}")
-            try:
-                self.last_image_path.unlink() # 删除文件
-                log.info(f"Successfully deleted previous image: {self.last_image_path}")
-            except OSError as e:
-                # 如果删除失败（例如文件被占用），记录错误但不中断流程
-                log.error(f"Failed to delete previous image {self.last_image_path}: {e}")
-            except Exception as e:
-                log.error(f"An unexpected error occurred while deleting {self.last_image_path}: {e}", exc_info=True)
-        # >>>>>> 删除逻辑结束 <<<<<<
-
-        # 生成图片
+        # 生成图片，同一订单的并发查询共用一次绘制
         log.info("Calling generate_image function...")
-        image_path = generate_image(order_details)
-        log.info(f"generate_image returned path: {image_path}")
+        image_path = await self._single_flight(
+            self._render_inflight, _order_key(order_id_user), lambda: self._render_image(order_id_user, order_details)
+        )
+        log.info("generate_image returned path: %s", image_path)
 
         if image_path and image_path.exists():
-            log.info(f"Image generated successfully and file exists at: {image_path}. Attempting to yield for sending.")
-
-            # >>>>>> 添加：更新上一张图片的路径为当前生成的图片路径 <<<<<<
-            self.last_image_path = image_path
-            log.info(f"Updated last_image_path to: {self.last_image_path}")
-            # >>>>>> 更新路径结束 <<<<<<
+            log.info("Image generated successfully and file exists at: %s. Attempting to yield for sending.", image_path)
 
             try:
                 # 将参数名从 path 改为 file，这里原来就是对的，无需改动
@@ -294,18 +462,17 @@ class HeyaoQueryStar(Star):
                 ]
                 # 这个 yield 只是将组件对象返回给框架，实际发送是异步的
                 yield event.chain_result(chain)
-                log.info(f"Image component yielded successfully for order {order_id_user}. Framework will handle sending.")
+                log.info("Image component yielded successfully for order %s. Framework will handle sending.", order_id_user)
 
             except Exception as e:
                 # 这个 except 捕获到了创建 ImageComp 对象时的错误
-                log.error(f"Caught exception during ImageComp creation or yield process for image {image_path}: {e}", exc_info=True)
+                log.error("Caught exception during ImageComp creation or yield process for image %s: %s", image_path, e, exc_info=True)
                 yield event.plain_result("生成图片成功，但发送时遇到问题。")
 
             # 清理临时文件的逻辑现在由插件内部处理，不需要额外的 finally 块或外部工具。
 
         else:
-            log.error(f"Image generation failed or file not found for order {order_id_user}. Returned path: {image_path}")
-            # 如果新的图片生成失败，则不更新 self.last_image_path，保留上一个成功的图片路径（如果存在）
+            log.error("Image generation failed or file not found for order %s. Returned path: %s", order_id_user, image_path)
             yield event.plain_result(f"成功获取订单信息，但在生成图片时失败。(订单号: {order_id_user})")
             log.info("handle_heyao_query finished (image generation failed).")
 